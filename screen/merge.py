@@ -17,6 +17,11 @@ b_cs_first_match_only  - SMILES can often be matched in two directions, say
                          If this is false (0), it merges the structures using
                          both palindromes. If it's true (1), it only uses
                          whichever direction it matches first.
+i_cs_max_matches       - Optional. Maximum number of pattern matches to use
+                         from this structure, counted after the full match and
+                         aromatic ring checks. Palindromic patterns can match
+                         in many orders, so this caps the number of merges
+                         attempted. If 0 or missing, all matches are used.
 b_cs_substructure      - If true, use `evaluate_substructure` to find atom
                          indices from the pattern, else use `evaluate_smarts`.
 b_cs_both_enantionmers - If true, will also use the other enantiomer of this
@@ -42,18 +47,34 @@ from __future__ import print_function
 from __future__ import absolute_import
 from __future__ import division
 import argparse
+import collections
+import concurrent.futures
 import copy
+import functools
+import logging
 import os
 import re
 import sys
 
+import numpy as np
 from schrodinger import structure as sch_struct
-from schrodinger.structutils import analyze, measure, rmsd, build
+from schrodinger.structutils import analyze, measure, build
+
+logger = logging.getLogger(__name__)
 
 ATOMS_TO_MOVE = ['RU','IR','RH','D1']
 
 DEBUG = False
 
+# Base name of the temporary files used by mini and mcmm. Worker processes
+# change this so they don't overwrite each other's files.
+TEMP_NAME = 'TEMP'
+
+# Atom numbers matched by each pattern. Keyed by connectivity_key(structure),
+# and then by (pattern, first_match_only, use_substructure). Only structures
+# read from the input files go in here, so its size is bounded by the inputs.
+PATTERN_MATCHES = {}
+
 def return_parser():
     """
     Parser for merge.
@@ -73,6 +94,16 @@ def return_parser():
         '-d', '--directory',
         type=str,
         help='Write all output structures individually to this directory.')
+    parser.add_argument(
+        '-v', '--verbose',
+        action='store_true',
+        help='Show the details of every merge (matches, bonds, RCA4 and TORC '
+        'updates).')
+    parser.add_argument(
+        '-n', '--nproc',
+        type=int, default=1,
+        help='Number of processes used to merge pairs of structures. Each '
+        'process runs its own MacroModel jobs. (default: %(default)s)')
     parser.add_argument(
         '-m', '--mini',
         action='store_true',
@@ -89,88 +120,223 @@ def main(opts):
     """
     Main for merge.
 
+    Merged structures are written out as they're made rather than being held
+    in memory until the end.
+
     Returns
     -------
-    list of Schrodinger structures
+    int
+        Number of structures written.
     """
-    structures = merge_many_filenames(opts.group)
-    print('-' * 80)
-    print('END NUMBER STRUCTURES: {}'.format(len(structures)))
+    structures = merge_many_filenames(opts.group, nproc=opts.nproc)
     if opts.mini:
-        structures = mini(structures)
-    new_structures = []
-    for structure in structures:
-        new_structures.append(add_chirality(structure))
-    structures = new_structures
+        # Finish all of the merging first. Every merge runs its own mini and
+        # mcmm, which reuse and then delete the same temporary files.
+        structures = mini(list(structures))
+    structures = (add_chirality(structure) for structure in structures)
     # All output below.
     # Write structures to a single file.
+    sch_writer = None
     if opts.output:
-        print('OUTPUT FILE: {}'.format(opts.output))
+        logger.info('OUTPUT FILE: %s', opts.output)
         sch_writer = sch_struct.StructureWriter(opts.output)
-        sch_writer.extend(structures)
-        sch_writer.close()
     # Write structures to a directory.
     if opts.directory:
-        print('OUTPUT DIRECTORY: {}'.format(opts.directory))
+        logger.info('OUTPUT DIRECTORY: %s', opts.directory)
+    num_structures = 0
+    # Merging happens inside this loop, so make sure the output file still
+    # gets closed if one of the merges fails.
+    try:
         for structure in structures:
-            path = make_unique_filename(
-                os.path.join(
-                    opts.directory,
-                    structure.property['s_m_title'] + '.mae'))
-            filename = os.path.basename(path)
-            print(' * WRITING : {}'.format(filename))
-            sch_writer = sch_struct.StructureWriter(path)
-            sch_writer.append(structure)
+            num_structures += 1
+            if sch_writer is not None:
+                sch_writer.append(structure)
+            if opts.directory:
+                path = make_unique_filename(
+                    os.path.join(
+                        opts.directory,
+                        structure.property['s_m_title'] + '.mae'))
+                filename = os.path.basename(path)
+                logger.info(' * WRITING : %s', filename)
+                # Each structure gets its own file, so one writer per
+                # structure is unavoidable here. Structure.write skips the
+                # writer bookkeeping.
+                structure.write(path)
+    finally:
+        if sch_writer is not None:
             sch_writer.close()
-    return structures
+    logger.info('-' * 80)
+    logger.info('END NUMBER STRUCTURES: %s', num_structures)
+    return num_structures
 
-def merge_many_filenames(list_of_lists):
+def merge_many_filenames(list_of_lists, nproc=1):
     """
-    Returns merged structures for a list of lists of filenames.
+    Iterator for merged structures from a list of lists of filenames.
+
+    The first group and every intermediate group of merged structures are
+    only ever looped over once, so they're streamed through a chain of
+    generators. Only the later groups of files, which get looped over once per
+    merged structure, are held in memory.
+
+    Files that show up in more than one group are only read once. See
+    read_filename.
+
+    If nproc is greater than 1, every level of merging shares a single pool of
+    that many processes.
 
     Arguments
     ---------
     list_of_lists : list of lists of filenames of *.mae
+    nproc : int
+            Number of processes used to merge pairs of structures.
+
+    Yields
+    ------
+    Schrodinger structure
     """
-    # Setup list for first group of filenames/structures.
-    structures = []
-    for filename in list_of_lists[0]:
-        structures.extend(read_filename(filename))
-    print('TOTAL NUM. STRUCTURES: {}'.format(len(structures)))
-    # Iterate over groups of filenames/structures.
+    # Files used more than once. These get cached rather than streamed.
+    counts = collections.Counter(
+        os.path.abspath(filename)
+        for filenames in list_of_lists
+        for filename in filenames)
+    repeated = set(path for path, count in counts.items() if count > 1)
+    # Setup generator for first group of filenames/structures.
+    structures = read_filenames(list_of_lists[0], repeated=repeated)
+    # The later groups get looped over many times, so read them all now.
+    groups_2 = []
     for filenames in list_of_lists[1:]:
-        new_structures = []
-        for filename in filenames:
-            new_structures.extend(read_filename(filename))
-        # Update existing list of structures after combining with the new
-        # structures.
-        
-        structures = list(merge_many_structures(structures, new_structures))
-        print('TOTAL NUM. STRUCTURES: {}'.format(len(structures)))
-    return list(structures)
-
-def read_filename(filename):
+        new_structures = list(read_filenames(filenames, repeated=repeated))
+        logger.info('TOTAL NUM. NEW STRUCTURES: %s', len(new_structures))
+        groups_2.append(new_structures)
+    if nproc <= 1:
+        for structure in merge_many_groups(structures, groups_2):
+            yield structure
+        return
+    # Structures are sent to and from the workers as Maestro strings. The later
+    # groups are only sent once, when each worker starts.
+    strings_2 = [[structure.writeToString(sch_struct.MAESTRO)
+                  for structure in group]
+                 for group in groups_2]
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=nproc,
+            initializer=init_merge_worker,
+            initargs=(logger.getEffectiveLevel(), strings_2)) as executor:
+        for structure in merge_many_groups(
+                structures, groups_2, executor=executor, nproc=nproc):
+            yield structure
+
+def merge_many_groups(structures, groups_2, executor=None, nproc=1):
+    """
+    Iterator for merging structures with each of the later groups in turn.
+
+    Each level is only merged once because merge_many_structures only loops
+    over its first argument once.
+
+    Arguments
+    ---------
+    structures : iterable of Schrodinger structures
+    groups_2 : list of lists of Schrodinger structures
+    executor : concurrent.futures.ProcessPoolExecutor or None
+    nproc : int
+            Number of processes in executor.
+
+    Yields
+    ------
+    Schrodinger structure
+    """
+    for group, new_structures in enumerate(groups_2):
+        structures = merge_many_structures(
+            structures, new_structures,
+            executor=executor, group=group, nproc=nproc)
+    for structure in structures:
+        yield structure
+
+def read_filenames(filenames, repeated=()):
+    """
+    Yields the structures, including enantiomers, from many files.
+
+    Arguments
+    ---------
+    filenames : list of strings
+    repeated : set of strings
+               Absolute paths of files that should be cached.
+
+    Yields
+    ------
+    Schrodinger structure objects
+    """
+    for filename in filenames:
+        cache = os.path.abspath(filename) in repeated
+        for structure in read_filename(filename, cache=cache):
+            yield structure
+
+def read_filename(filename, cache=False):
     """
     Just helps with the logging.
 
+    If cache is true, the structures are only read from the file the first
+    time, and copies of them are yielded after that.
+
     Arguments
     ---------
     filename : string
+    cache : bool
+
+    Yields
+    ------
+    Schrodinger structure objects
+    """
+    logger.info('>>> filename: %s', filename)
+    if cache:
+        path = os.path.abspath(filename)
+        # Copies, since superimposing moves structures in place.
+        structures = (structure.copy() for structure in
+                      load_filename(path, os.path.getmtime(path)))
+    else:
+        structures = iter_filename(filename)
+    num_structures = 0
+    for structure in structures:
+        num_structures += 1
+        yield structure
+    logger.info('%s : %s structures (including enantiomers)',
+                filename, num_structures)
+
+@functools.lru_cache(maxsize=None)
+def load_filename(path, mtime):
+    """
+    Reads and caches every structure, including enantiomers, from a file.
+
+    Arguments
+    ---------
+    path : string
+           Absolute path to the file.
+    mtime : float
+            Modification time of the file. Only used as part of the cache key
+            so that a file changed on disk gets read again.
 
     Returns
     -------
-    list of Schrodinger structure objects
+    tuple of Schrodinger structure objects
+    """
+    return tuple(iter_filename(path))
+
+def iter_filename(filename):
+    """
+    Yields the structures, including enantiomers, from a file.
+
+    Arguments
+    ---------
+    filename : string
+
+    Yields
+    ------
+    Schrodinger structure objects
     """
-    print('>>> filename: {}'.format(filename))
-    structures = []
     sch_reader = sch_struct.StructureReader(filename)
     for structure in sch_reader:
         for enantiomer in load_enantiomers(structure):
-            structures.append(enantiomer)
+            yield enantiomer
     sch_reader.close()
-    print('{} : {} structures (including enantiomers)'.format(
-        filename, len(structures)))
-    return structures
 
 def load_enantiomers(structure):
     """
@@ -195,33 +361,128 @@ def load_enantiomers(structure):
     # I dunno if I like this style. Seems to work though.
     yield structure
     if structure.property.get('b_cs_both_enantiomers', False):
-        print(' - LOADING OTHER ENANTIOMER: {}'.format(
-            structure.property['s_m_title']))
-        other_enantiomer = copy.deepcopy(structure)
-        for coords in other_enantiomer.getXYZ(copy=False):
-            coords[0] = -coords[0]
+        logger.info(' - LOADING OTHER ENANTIOMER: %s',
+                    structure.property['s_m_title'])
+        other_enantiomer = structure.copy()
+        # getXYZ(copy=False) is a view of the atom coordinates, so negating
+        # the x column in one NumPy operation updates the structure in place.
+        coords = other_enantiomer.getXYZ(copy=False)
+        coords[:, 0] *= -1
         structures = [other_enantiomer]
         yield structures[0]
 
-def merge_many_structures(structures_1, structures_2):
+def merge_many_structures(structures_1, structures_2, executor=None, group=0,
+                          nproc=1):
     """
     Iterator for combining two lists of structures.
 
+    Every structure in structures_1 is merged with each of structures_2. If an
+    executor is given, this is done in its worker processes, which must have
+    been started with init_merge_worker. Either way, the merged structures are
+    yielded in the same order.
+
     Arguments
     ---------
     structures_1 : list of Schrodinger structures
     structures_2 : list of Schrodinger structures
+    executor : concurrent.futures.ProcessPoolExecutor or None
+    group : int
+            Index of structures_2 in the groups given to init_merge_worker.
+    nproc : int
+            Number of processes in executor.
 
     Yields
     ------
     Schrodinger structure
     """
+    # structures_2 is looped over once per structure in structures_1, so it
+    # can't be a generator that would be used up after the first pass.
+    structures_2 = list(structures_2)
+    if executor is None:
+        matches_2 = [get_pattern_matches(x) for x in structures_2]
+        for structure_1 in structures_1:
+            # structure_1 is matched against the same patterns for many of the
+            # structures in structures_2. It's only used here, so these
+            # matches are thrown away afterwards.
+            matches_1 = {}
+            for structure_2, cache_2 in zip(structures_2, matches_2):
+                for structure in merge(structure_1, structure_2,
+                                       matches_1=matches_1,
+                                       matches_2=cache_2):
+                    yield structure
+        return
+    # Each structure_1 is merged with all of structures_2 by one worker. Only
+    # keep a few of them queued per worker so structures_1 is still streamed.
+    # Results are yielded in the order they were submitted.
+    max_pending = 2 * nproc
+    pending = collections.deque()
     for structure_1 in structures_1:
-        for structure_2 in structures_2:
-            for structure in merge(structure_1, structure_2):
-                yield structure
+        string_1 = structure_1.writeToString(sch_struct.MAESTRO)
+        pending.append(executor.submit(merge_strings, string_1, group))
+        if len(pending) >= max_pending:
+            for string in pending.popleft().result():
+                yield read_string(string)
+    while pending:
+        for string in pending.popleft().result():
+            yield read_string(string)
+
+# Later groups of structures to merge onto, read once by each worker process.
+WORKER_STRUCTURES_2 = []
+# Pattern matches for each structure in WORKER_STRUCTURES_2.
+WORKER_MATCHES_2 = []
+
+def init_merge_worker(log_level, strings_2):
+    """
+    Gives each worker process its own names for the MacroModel temporary
+    files, makes sure it logs at the same level as the main process and reads
+    in the later groups of structures.
 
-def merge(struct_1, struct_2):
+    Arguments
+    ---------
+    log_level : int
+    strings_2 : list of lists of strings
+                Maestro strings for each of the later groups.
+    """
+    global TEMP_NAME
+    logging.basicConfig(
+        format='%(message)s', level=log_level, stream=sys.stdout)
+    TEMP_NAME = 'TEMP_{}'.format(os.getpid())
+    WORKER_STRUCTURES_2[:] = [[read_string(x) for x in strings]
+                              for strings in strings_2]
+    WORKER_MATCHES_2[:] = [[get_pattern_matches(x) for x in structures]
+                           for structures in WORKER_STRUCTURES_2]
+
+def merge_strings(string_1, group):
+    """
+    Merges a structure stored as a Maestro string with every structure in one
+    of the groups held by the worker. Used by the worker processes in
+    merge_many_structures.
+
+    Arguments
+    ---------
+    string_1 : string
+    group : int
+            Index of the group in WORKER_STRUCTURES_2.
+
+    Returns
+    -------
+    list of strings
+    """
+    struct_1 = read_string(string_1)
+    matches_1 = {}
+    return [structure.writeToString(sch_struct.MAESTRO)
+            for struct_2, matches_2 in zip(WORKER_STRUCTURES_2[group],
+                                           WORKER_MATCHES_2[group])
+            for structure in merge(struct_1, struct_2,
+                                   matches_1=matches_1, matches_2=matches_2)]
+
+def read_string(string):
+    """
+    Reads a single Schrödinger structure from a Maestro string.
+    """
+    return next(sch_struct.StructureReader.fromString(string))
+
+def merge(struct_1, struct_2, matches_1=None, matches_2=None):
     """
     Takes two Schrödinger structures and combines them.
 
@@ -233,49 +494,92 @@ def merge(struct_1, struct_2):
     ---------
     struct_1 : Schrödinger structure object
     struct_2 : Schrödinger structure object
+    matches_1 : dict or None
+                Pattern matches already found in struct_1. See
+                get_atom_numbers_from_structure_with_pattern.
+    matches_2 : dict or None
+                Pattern matches already found in struct_2.
 
     Yields
     ------
     Schrödinger structure objects
     """
     # Determine the structures that overlap.
-    match_1s, match_2s = get_overlapping_atoms_in_both(struct_1, struct_2)
-    print('MATCHES FROM STRUCTURE 1: {}'.format(match_1s))
-    print('MATCHES FROM STRUCTURE 2: {}'.format(match_2s))
+    match_1s, match_2s = get_overlapping_atoms_in_both(
+        struct_1, struct_2, matches_1=matches_1, matches_2=matches_2)
+    logger.debug('MATCHES FROM STRUCTURE 1: %s', match_1s)
+    logger.debug('MATCHES FROM STRUCTURE 2: %s', match_2s)
     seen = set()
     for match_1 in match_1s:
         # Eliminate duplicates 1st.
         for match_2 in match_2s:
-            print('-' * 80)
+            logger.debug('-' * 80)
             # Remove the zero's if they exist.
             new_match_1, new_match_2 = remove_index_from_both_if_equals_zero(
                 match_1, match_2)
-            print('TRIMMED: {} {}'.format(new_match_1, new_match_2))
+            logger.debug('TRIMMED: %s %s', new_match_1, new_match_2)
             tup = tuple(new_match_2)
             if tup not in seen:
                 seen.add(tup)
                 if struct_2.property.get('b_cs_first_match_only', False):
                     seen.add(tup[::-1])
-                    print(' - Unique! Continuing.')
+                    logger.debug(' - Unique! Continuing.')
                     # Just to look good.
-                print('-' * 80)
-                print(' * ALIGNING:')
-                print('   * {:<30} {} {}'.format(
+                logger.info('-' * 80)
+                logger.info(' * ALIGNING:')
+                logger.info(
+                    '   * %-30s %s %s',
                     struct_1.title,
                     new_match_1,
-                    [struct_1.atom[x].atom_type_name for x in new_match_1]))
-                print('   * {:<30} {} {}'.format(
+                    [struct_1.atom[x].atom_type_name for x in new_match_1])
+                logger.info(
+                    '   * %-30s %s %s',
                     struct_2.title,
                     new_match_2,
-                    [struct_2.atom[x].atom_type_name for x in new_match_2]))
+                    [struct_2.atom[x].atom_type_name for x in new_match_2])
                     # Real work below.
-                rmsd.superimpose(struct_1, new_match_1, struct_2, new_match_2)
+                # The fit depends on the coordinates of both structures, not
+                # just the matched atom types, and each match_2 only gets here
+                # once per merge call, so there's no transform worth caching.
+                superimpose(struct_1, new_match_1, struct_2, new_match_2)
                 yield merge_structures_from_matching_atoms(
                     struct_1, new_match_1, struct_2, new_match_2)
             else:
-                print(' - Not unique! Skipping.')
+                logger.debug(' - Not unique! Skipping.')
+
+def superimpose(struct_1, match_1, struct_2, match_2):
+    """
+    Moves struct_2 so that the atoms in match_2 are overlaid on the atoms in
+    match_1 of struct_1 with the lowest RMSD.
+
+    Does the same thing as `schrodinger.structutils.rmsd.superimpose`, but
+    solves the Kabsch problem directly with NumPy. The patterns usually only
+    have a handful of atoms, so this is just a 3x3 SVD.
 
-def get_overlapping_atoms_in_both(struct_1, struct_2):
+    Arguments
+    ---------
+    struct_1 : Schrödinger structure object
+    match_1 : list of integers
+    struct_2 : Schrödinger structure object
+               Coordinates are updated in place.
+    match_2 : list of integers
+    """
+    # Atom indices start at 1, array indices start at 0.
+    xyz_1 = struct_1.getXYZ(copy=False)[np.asarray(match_1) - 1]
+    xyz_2_all = struct_2.getXYZ(copy=True)
+    xyz_2 = xyz_2_all[np.asarray(match_2) - 1]
+    centroid_1 = xyz_1.mean(axis=0)
+    centroid_2 = xyz_2.mean(axis=0)
+    covariance = np.dot((xyz_2 - centroid_2).T, xyz_1 - centroid_1)
+    u, _, vt = np.linalg.svd(covariance)
+    # Make sure this is a proper rotation and not a reflection.
+    if np.linalg.det(np.dot(vt.T, u.T)) < 0:
+        vt[-1] *= -1
+    rotation = np.dot(vt.T, u.T)
+    struct_2.setXYZ(np.dot(xyz_2_all - centroid_2, rotation.T) + centroid_1)
+
+def get_overlapping_atoms_in_both(struct_1, struct_2, matches_1=None,
+                                  matches_2=None):
     """
     Uses properties stored inside the 2nd structure to locate a set or sets of
     matching atoms inside both structures.
@@ -289,6 +593,11 @@ def get_overlapping_atoms_in_both(struct_1, struct_2):
     ---------
     struct_1 : Schrödinger structure object
     struct_2 : Schrödinger structure object
+    matches_1 : dict or None
+                Pattern matches already found in struct_1. See
+                get_atom_numbers_from_structure_with_pattern.
+    matches_2 : dict or None
+                Pattern matches already found in struct_2.
 
     Returns
     -------
@@ -301,28 +610,30 @@ def get_overlapping_atoms_in_both(struct_1, struct_2):
     # analyze.evaluate_substructure from struct_2 (this needs to match the
     # pattern from struct_2).
     use_substructure = struct_2.property.get('b_cs_use_substructure', False)
-    print(' * PATTERNS: {}'.format(patterns))
+    logger.debug(' * PATTERNS: %s', patterns)
     for pattern in patterns:
-        print('   * CHECKING: {}'.format(pattern))
+        logger.debug('   * CHECKING: %s', pattern)
         match_struct_1 = get_atom_numbers_from_structure_with_pattern(
             struct_1,
             pattern,
             first_match_only=struct_1.property.get(
                 'b_cs_first_match_only', False),
-            use_substructure=use_substructure)
+            use_substructure=use_substructure,
+            cache=matches_1)
         if match_struct_1:
-            print('     * FOUND IN: {}'.format(struct_1.title))
+            logger.debug('     * FOUND IN: %s', struct_1.title)
             match_struct_2 = get_atom_numbers_from_structure_with_pattern(
                 struct_2,
                 pattern,
                 first_match_only=struct_2.property.get(
                     'b_cs_first_match_only', False),
-                use_substructure=use_substructure)
+                use_substructure=use_substructure,
+                cache=matches_2)
             if match_struct_2:
-                print('     * FOUND IN: {}'.format(struct_2.title))
+                logger.debug('     * FOUND IN: %s', struct_2.title)
             break
         else:
-            print('     * COULDN\'T FIND IN: {}'.format(struct_2.title))
+            logger.debug('     * COULDN\'T FIND IN: %s', struct_2.title)
             continue
     # This is an interesting way to ensure we have actually found something for
     # match_struct_1 and match_struct_2.
@@ -330,14 +641,14 @@ def get_overlapping_atoms_in_both(struct_1, struct_2):
         match_struct_1
         match_struct_2
     except UnboundLocalError as e:
-        print('ERROR: {} {}'.format(
-            struct_1.property['s_m_title'],
-            struct_2.property['s_m_title']))
+        logger.error('ERROR: %s %s',
+                     struct_1.property['s_m_title'],
+                     struct_2.property['s_m_title'])
         raise e
 
     # 1.) Eliminate all with zero if b_cs_full_match_only.
-    print('>>> match_struct_1: {}'.format(match_struct_1))
-    print('>>> match_struct_2: {}'.format(match_struct_2))
+    logger.debug('>>> match_struct_1: %s', match_struct_1)
+    logger.debug('>>> match_struct_2: %s', match_struct_2)
     if struct_1.property.get('b_cs_full_match_only', False):
         new_match_struct_1 = []
         for match in match_struct_1:
@@ -352,8 +663,8 @@ def get_overlapping_atoms_in_both(struct_1, struct_2):
                 new_match_struct_2.append(match)
     else:
         new_match_struct_2 = match_struct_2
-    print('>>> new_match_struct_1: {}'.format(new_match_struct_1))
-    print('>>> new_match_struct_2: {}'.format(new_match_struct_2))
+    logger.debug('>>> new_match_struct_1: %s', new_match_struct_1)
+    logger.debug('>>> new_match_struct_2: %s', new_match_struct_2)
 
     # Sometimes a match is made that isn't what is wanted by the user and
     # incorporates an aromatic where it should not be. This prevents aryl
@@ -390,8 +701,16 @@ def get_overlapping_atoms_in_both(struct_1, struct_2):
                         use_match = False
         if use_match:
             new_new_match_struct_2.append(match)
-    print('>>> new_new_match_struct_1: {}'.format(new_new_match_struct_1))
-    print('>>> new_new_match_struct_2: {}'.format(new_new_match_struct_2))
+    logger.debug('>>> new_new_match_struct_1: %s', new_new_match_struct_1)
+    logger.debug('>>> new_new_match_struct_2: %s', new_new_match_struct_2)
+
+    # Only cap the number of matches once the unusable ones are gone.
+    max_matches_1 = struct_1.property.get('i_cs_max_matches', 0)
+    if max_matches_1:
+        del new_new_match_struct_1[max_matches_1:]
+    max_matches_2 = struct_2.property.get('i_cs_max_matches', 0)
+    if max_matches_2:
+        del new_new_match_struct_2[max_matches_2:]
 
     # 2.) Eliminate zeroes indices from within lists.
     # Actually, maybe it's best to do this upon application in a case by case
@@ -402,7 +721,7 @@ def get_overlapping_atoms_in_both(struct_1, struct_2):
     # print('>>> match_struct_2: {}'.format(match_struct_2))
     # new_match_struct_1 = []
     # new_match_struct_2 = []
-    # for sub_match_struct_1, sub_match_struct_2 in itertools.izip(
+    # for sub_match_struct_1, sub_match_struct_2 in zip(
     #         match_struct_1, match_struct_2):
     #     sub_match_struct_1, sub_match_struct_2 = \
     #         remove_index_from_both_if_equals_zero(
@@ -416,7 +735,8 @@ def get_overlapping_atoms_in_both(struct_1, struct_2):
 def get_atom_numbers_from_structure_with_pattern(structure,
                                                  pattern,
                                                  first_match_only=False,
-                                                 use_substructure=False):
+                                                 use_substructure=False,
+                                                 cache=None):
     """
     Gets the atom indices inside a structure that match a pattern.
 
@@ -432,12 +752,18 @@ def get_atom_numbers_from_structure_with_pattern(structure,
        `first_match_only` chooses whether to use all of the matches or just the
        first one.
 
+    If `cache` is a dictionary, the matches are stored in it, keyed by
+    (pattern, first_match_only, use_substructure). Pass the same dictionary
+    every time the same structure is matched. See get_pattern_matches.
+    Patterns with stereochemistry (@) are never cached.
+
     Arguments
     ---------
     structure : Schrödinger structure object
     pattern : string
     first_match_only : bool
     use_substructure : bool
+    cache : dict or None
 
     Returns
     -------
@@ -447,6 +773,75 @@ def get_atom_numbers_from_structure_with_pattern(structure,
     # print(">>> pattern: {}".format(pattern))
     # print(">>> first_match_only: {}".format(first_match_only))
     # print(">>> use_substructure: {}".format(use_substructure))
+    # evaluate_smarts() checks chirality, so the two enantiomers, which share
+    # their matches in PATTERN_MATCHES, can match these patterns differently.
+    if cache is None or '@' in pattern:
+        return match_pattern(
+            structure, pattern, first_match_only, use_substructure)
+    key = (pattern, first_match_only, use_substructure)
+    if key not in cache:
+        cache[key] = match_pattern(
+            structure, pattern, first_match_only, use_substructure)
+    return [list(x) for x in cache[key]]
+
+def get_pattern_matches(structure):
+    """
+    Gets the shared pattern matches for a structure read from the input files.
+
+    The same structures get matched against the same patterns for every pair
+    in merge_many_structures. Matching only depends on connectivity, so
+    superimposing a structure doesn't change the result. Keying on the
+    connectivity also lets both enantiomers, and copies of a structure read
+    from different files, share the same matches.
+
+    Don't use this for merged structures. Every one of those is unique, so
+    they would just grow PATTERN_MATCHES.
+
+    Arguments
+    ---------
+    structure : Schrödinger structure object
+
+    Returns
+    -------
+    dict
+        Use as `cache` in get_atom_numbers_from_structure_with_pattern.
+    """
+    return PATTERN_MATCHES.setdefault(connectivity_key(structure), {})
+
+def connectivity_key(structure):
+    """
+    Hashable description of a structure's atoms and bonds, in atom order.
+
+    Covers the element, atom type and formal charge of every atom, plus the
+    bond orders. Atom types alone aren't enough, since the same type is used
+    for different elements (ex. 62 for P, Pd and Ru) and patterns can be
+    element specific. Canonical SMILES isn't used here because the matches are
+    atom indices, so two structures only share matches if their atoms are in
+    the same order.
+    Coordinates are left out, so the two enantiomers made by load_enantiomers
+    have the same key.
+
+    Arguments
+    ---------
+    structure : Schrödinger structure object
+
+    Returns
+    -------
+    tuple
+    """
+    atoms = tuple(
+        (atom.atomic_number, atom.atom_type, atom.formal_charge)
+        for atom in structure.atom)
+    bonds = tuple(sorted(
+        (bond.atom1.index, bond.atom2.index, bond.order)
+        for bond in structure.bond))
+    return atoms, bonds
+
+def match_pattern(structure, pattern, first_match_only, use_substructure):
+    """
+    Does the actual work for get_atom_numbers_from_structure_with_pattern
+    without any caching.
+    """
     if use_substructure:
         atom_numbers = analyze.evaluate_substructure(
             structure,
@@ -525,31 +920,46 @@ def merge_structures_from_matching_atoms(struct_1, match_1, struct_2, match_2):
     common_atoms_2 = [x + num_atoms for x in match_2]
     common_atoms_2 = [merge.atom[x] for x in common_atoms_2]
     common_atoms_1 = [merge.atom[x] for x in match_1]
-
-    print(' * AFTER MERGE:')
-    print('   * {:<30} {} {}'.format(
-        struct_2.title,
-        [x.index for x in common_atoms_2],
-        [x.atom_type_name for x in common_atoms_2]))
-    print('ATOMS IN ORIGINAL STRUCTURE: {:>5}'.format(num_atoms))
-    print('ATOMS IN MERGED STRUCTURE:   {:>5}'.format(len(merge.atom)))
-    print('ATOMS IN NEW STRUCTURE:      {:>5}'.format(
-        len(merge.atom) - len(common_atoms_1)))
-    print('-' * 80)
+    # Maps the merged structure's atom index for each common atom from struct_2
+    # to its position in common_atoms_2 (and hence common_atoms_1).
+    common_index_2 = {atom.index: i for i, atom in enumerate(common_atoms_2)}
+    # Bonds between two common atoms show up once from each end. Only copy them
+    # over the first time.
+    merged_bonds = set()
+    # Only look up the atom and bond details needed for the debug messages if
+    # they're actually going to be shown.
+    debug = logger.isEnabledFor(logging.DEBUG)
+
+    if debug:
+        logger.debug(' * AFTER MERGE:')
+        logger.debug(
+            '   * %-30s %s %s',
+            struct_2.title,
+            [x.index for x in common_atoms_2],
+            [x.atom_type_name for x in common_atoms_2])
+        logger.debug('ATOMS IN ORIGINAL STRUCTURE: %5s', num_atoms)
+        logger.debug('ATOMS IN MERGED STRUCTURE:   %5s', len(merge.atom))
+        logger.debug('ATOMS IN NEW STRUCTURE:      %5s',
+                     len(merge.atom) - len(common_atoms_1))
+        logger.debug('-' * 80)
     # Look at all the common atoms in struct_2.
     for i, (common_atom_1, common_atom_2) in enumerate(
             zip(common_atoms_1, common_atoms_2)):
-        print('CHECKING COMMON ATOM {}:'.format(i + 1))
-        print(' * ORIGINAL ATOM:      {:>4}/{}'.format(
-            common_atom_1.index,
-            common_atom_1.atom_type_name))
-        for original_bond in common_atom_1.bond:
-            print('   * BOND:             {:>4}/{} {:>4}/{}'.format(
-                original_bond.atom1.index, original_bond.atom1.atom_type_name,
-                original_bond.atom2.index, original_bond.atom2.atom_type_name))
-        print(' * MATCHING ATOM:           {:>4}/{}'.format(
-            common_atom_2.index,
-            common_atom_2.atom_type_name))
+        if debug:
+            logger.debug('CHECKING COMMON ATOM %s:', i + 1)
+            logger.debug(' * ORIGINAL ATOM:      %4s/%s',
+                         common_atom_1.index,
+                         common_atom_1.atom_type_name)
+            for original_bond in common_atom_1.bond:
+                logger.debug(
+                    '   * BOND:             %4s/%s %4s/%s',
+                    original_bond.atom1.index,
+                    original_bond.atom1.atom_type_name,
+                    original_bond.atom2.index,
+                    original_bond.atom2.atom_type_name)
+            logger.debug(' * MATCHING ATOM:           %4s/%s',
+                         common_atom_2.index,
+                         common_atom_2.atom_type_name)
         # If a user is templating struct2 onto struct1, but struct1 has a wild
         # card indicated for one of the matching atoms then we need to replace
         # the atom type with that of struct2. This allows more variablity and
@@ -584,15 +994,20 @@ def merge_structures_from_matching_atoms(struct_1, match_1, struct_2, match_2):
         # common_atom_1.z = (common_atom_1.z + common_atom_2.z) / 2
 
         for merge_bond in common_atom_2.bond:
-            print('   * BOND:             {:>4}/{} {:>4}/{}'.format(
-                merge_bond.atom1.index, merge_bond.atom1.atom_type_name,
-                merge_bond.atom2.index, merge_bond.atom2.atom_type_name))
+            pair = frozenset((merge_bond.atom1.index, merge_bond.atom2.index))
+            if pair in merged_bonds:
+                continue
+            merged_bonds.add(pair)
+            if debug:
+                logger.debug(
+                    '   * BOND:             %4s/%s %4s/%s',
+                    merge_bond.atom1.index, merge_bond.atom1.atom_type_name,
+                    merge_bond.atom2.index, merge_bond.atom2.atom_type_name)
 
             # This is the atom in struct_1 that matches the 1st atom of the bond
             # in struct_2.
             # Actually, is this necessary? Isn't this just common_atom_1?
-            atom1 = common_atoms_1[
-                common_atoms_2.index(merge_bond.atom1)]
+            atom1 = common_atoms_1[common_index_2[merge_bond.atom1.index]]
 
             # These bonds already exist in the original structure.
 
@@ -601,31 +1016,36 @@ def merge_structures_from_matching_atoms(struct_1, match_1, struct_2, match_2):
 
             # We want to copy any new properties from the bonds in the merged
             # structure into the original bonds.
-            if merge_bond.atom2 in common_atoms_2:
-                atom2 = common_atoms_1[
-                    common_atoms_2.index(merge_bond.atom2)]
+            if merge_bond.atom2.index in common_index_2:
+                atom2 = common_atoms_1[common_index_2[merge_bond.atom2.index]]
                 # Bond that we want to copy properties to.
                 # Surprise! This can return None. You'd think that should raise
                 # an exception.
                 bond = merge.getBond(atom1, atom2)
                 if bond is None:
                     atom1.addBond(atom2.index, merge_bond.order)
-                    print('     * ADDED:         {:>4}/{} {:>4}/{}'.format(
+                    bond = merge.getBond(atom1, atom2)
+                    if debug:
+                        logger.debug(
+                            '     * ADDED:         %4s/%s %4s/%s',
+                            atom1.index, atom1.atom_type_name,
+                            atom2.index, atom2.atom_type_name)
+                elif debug:
+                    logger.debug(
+                        '     * UPDATED:       %4s/%s %4s/%s',
                         atom1.index, atom1.atom_type_name,
-                        atom2.index, atom2.atom_type_name))
-                else:
-                    print('     * UPDATED:       {:>4}/{} {:>4}/{}'.format(
-                        atom1.index, atom1.atom_type_name,
-                        atom2.index, atom2.atom_type_name))
+                        atom2.index, atom2.atom_type_name)
             # If the bond doesn't exist in struct_1, we want to make a new one.
             else:
                 atom2 = merge_bond.atom2
                 atom1.addBond(atom2.index, merge_bond.order)
-                print('     * ADDED:         {:>4}/{} {:>4}/{}'.format(
-                    atom1.index, atom1.atom_type_name,
-                    atom2.index, atom2.atom_type_name))
+                bond = merge.getBond(atom1, atom2)
+                if debug:
+                    logger.debug(
+                        '     * ADDED:         %4s/%s %4s/%s',
+                        atom1.index, atom1.atom_type_name,
+                        atom2.index, atom2.atom_type_name)
 
-            bond = merge.getBond(atom1, atom2)
             for k, v in merge_bond.property.items():
                 # Here, bond is the duplicate bond in struct_1 or the new bond.
                 if k not in bond.property or not bond.property[k]:
@@ -639,25 +1059,39 @@ def merge_structures_from_matching_atoms(struct_1, match_1, struct_2, match_2):
             #common_atom_1.atom_type = common_atom_2.atom_type
             #common_atom_1.color = common_atom_2.color
 
-    print('-' * 80)
-    fix_torsions = get_torc(struct_1, struct_2, match_1, match_2)
-    print('TORSION RESTRAINTS: {}'.format(fix_torsions))
+    logger.debug('-' * 80)
+    # Where every atom of struct_2 ends up after merging and deleting the
+    # common atoms. Shared by get_torc and all of the add_bond_prop calls.
+    atom_map = get_atom_map(struct_1, match_1, struct_2, match_2)
+    fix_torsions = get_torc(struct_1, struct_2, match_1, match_2,
+                            atom_map=atom_map)
+    logger.debug('TORSION RESTRAINTS: %s', fix_torsions)
 
     # Delete duplicate atoms once you copied all the data.
     merge.deleteAtoms(common_atoms_2)
+    # Look up bonds by their pair of atom indices. Shared by all of the
+    # add_bond_prop calls below since none of them add or delete atoms.
+    bonds = {frozenset((bond.atom1.index, bond.atom2.index)): bond
+             for bond in merge.bond}
     # This code is so dumb.
     merge = add_bond_prop(merge,
                           struct_1, match_1,
                           struct_2, match_2,
-                          name='rca4')
+                          name='rca4',
+                          bonds=bonds,
+                          atom_map=atom_map)
     merge = add_bond_prop(merge,
                           struct_1, match_1,
                           struct_2, match_2,
-                          name='torca')
+                          name='torca',
+                          bonds=bonds,
+                          atom_map=atom_map)
     merge = add_bond_prop(merge,
                           struct_1, match_1,
                           struct_2, match_2,
-                          name='torcb')
+                          name='torcb',
+                          bonds=bonds,
+                          atom_map=atom_map)
 
     merge.property['s_m_title'] += '_' + struct_2.property['s_m_title']
     if hasattr(struct_2, 's_m_entry_name'):
@@ -727,10 +1161,13 @@ def add_chirality(structure):
     Uses Schrödinger's utilities to assign chirality to atoms, and then adds
     that information to the title and entry name of structures.
     """
+    # Every merged structure is minimized with the atoms of struct_2 free to
+    # move, so chirality from the parent structures can't be reused. Perceive
+    # it once here and build the suffix in one pass.
     chirality_dic = analyze.get_chiral_atoms(structure)
-    string = '_'
-    for key, value in chirality_dic.items():
-        string += '{}{}'.format(key, value.lower())
+    string = '_' + ''.join(
+        '{}{}'.format(key, value.lower())
+        for key, value in chirality_dic.items())
     structure.property['s_m_title'] += string
     structure.property['s_m_entry_name'] += string
     return structure
@@ -749,15 +1186,53 @@ def search_dic_keys(dic, lookup):
         if lookup in key:
             yield value
 
-def get_torc(struct_1, struct_2, match_1, match_2):
+def get_atom_map(struct_1, match_1, struct_2, match_2):
     """
-    Generates FXTA commands for MacroModel from TORC commands.
+    Finds where every atom of struct_2 ends up in the merged structure, after
+    the common atoms of struct_2 have been deleted.
+
+    Arguments
+    ---------
+    struct_1 : Schrödinger structure object
+    match_1 : list of integers
+    struct_2 : Schrödinger structure object
+    match_2 : list of integers
 
-    Very repetitive code. Whole thing should get an update when a better atom to
-    atom conversion is used.
+    Returns
+    -------
+    list of integers
+        Index i holds the merged structure's index for atom i of struct_2.
+        Index 0 is unused because atom indices start at 1.
     """
     num_atoms = len(struct_1.atom)
-    new_match_2 = [x + num_atoms for x in match_2]
+    match_2_to_1 = dict(zip(match_2, match_1))
+    atom_map = [None]
+    num_deleted = 0
+    for x in range(1, len(struct_2.atom) + 1):
+        if x in match_2_to_1:
+            # If the atom is one of the matching/duplicate/common atoms, it's
+            # going to get deleted. This replaces the index of that atom with
+            # the matching atom in the 1st structure.
+            atom_map.append(match_2_to_1[x])
+            num_deleted += 1
+        else:
+            # The atoms in 2nd structure will always be added after the atoms
+            # in the 1st structure. Any common atoms before this one are going
+            # to get deleted, so we need to account for them disappearing.
+            atom_map.append(x + num_atoms - num_deleted)
+    return atom_map
+
+def get_torc(struct_1, struct_2, match_1, match_2, atom_map=None):
+    """
+    Generates FXTA commands for MacroModel from TORC commands.
+
+    Very repetitive code.
+
+    atom_map is the result of get_atom_map. Made from the other arguments if
+    not given.
+    """
+    if atom_map is None:
+        atom_map = get_atom_map(struct_1, match_1, struct_2, match_2)
     fix_torsions = []
     for bond in struct_2.bond:
         if bond.property['i_cs_torc_a1']:
@@ -770,16 +1245,7 @@ def get_torc(struct_1, struct_2, match_1, match_2):
             torsion = struct_2.measure(
                 atoms[0], atoms[1], atoms[2], atoms[3])
             # Update atom numbers.
-            new_atoms = []
-            for atom in atoms:
-                if atom in match_2:
-                    new_atoms.append(match_1[match_2.index(atom)])
-                else:
-                    new_index = atom + num_atoms
-                    atoms_in_str_2_before_this_one = \
-                        sum(i < new_index for i in new_match_2)
-                    new_index -= atoms_in_str_2_before_this_one
-                    new_atoms.append(new_index)
+            new_atoms = [atom_map[atom] for atom in atoms]
             fix_torsions.append((
                 new_atoms[0],
                 new_atoms[1],
@@ -797,16 +1263,7 @@ def get_torc(struct_1, struct_2, match_1, match_2):
             torsion = struct_2.measure(
                 atoms[0], atoms[1], atoms[2], atoms[3])
             # Update atom numbers.
-            new_atoms = []
-            for atom in atoms:
-                if atom in match_2:
-                    new_atoms.append(match_1[match_2.index(atom)])
-                else:
-                    new_index = atom + num_atoms
-                    atoms_in_str_2_before_this_one = \
-                        sum(i < new_index for i in new_match_2)
-                    new_index -= atoms_in_str_2_before_this_one
-                    new_atoms.append(new_index)
+            new_atoms = [atom_map[atom] for atom in atoms]
             fix_torsions.append((
                 new_atoms[0],
                 new_atoms[1],
@@ -815,7 +1272,8 @@ def get_torc(struct_1, struct_2, match_1, match_2):
                 torsion))
     return fix_torsions
 
-def add_bond_prop(merge, struct_1, match_1, struct_2, match_2, name=None):
+def add_bond_prop(merge, struct_1, match_1, struct_2, match_2, name=None,
+                  bonds=None, atom_map=None):
     """
     Takes the RCA4 and TORC properties from two structures and properly combines
     them into the merged structures.
@@ -843,6 +1301,12 @@ def add_bond_prop(merge, struct_1, match_1, struct_2, match_2, name=None):
     match_2 : string
     name : string
            "rca4", "torca", or "torcb"
+    bonds : dictionary
+            Bonds of merge keyed by the frozenset of their atom indices. Made
+            from merge if not given.
+    atom_map : list of integers
+               Result of get_atom_map. Made from the other arguments if not
+               given.
 
     Returns
     -------
@@ -860,14 +1324,17 @@ def add_bond_prop(merge, struct_1, match_1, struct_2, match_2, name=None):
         string = 'TORC'
         str1 = 'i_cs_torc_b1'
         str2 = 'i_cs_torc_b4'
+    if bonds is None:
+        bonds = {frozenset((bond.atom1.index, bond.atom2.index)): bond
+                 for bond in merge.bond}
     lists_of_atoms = []
     for bond in struct_2.bond:
         try:
             bond.property[str1]
             bond.property[str2]
         except KeyError as e:
-            print('ERROR! NO {}: {}'.format(
-                string, struct_2.property['s_m_title']))
+            logger.error('ERROR! NO %s: %s',
+                         string, struct_2.property['s_m_title'])
             raise e
         if bond.property[str1]:
             atoms = [bond.property[str1],
@@ -875,62 +1342,44 @@ def add_bond_prop(merge, struct_1, match_1, struct_2, match_2, name=None):
                      bond.atom2.index,
                      bond.property[str2]]
             lists_of_atoms.append(atoms)
-    print('{}:     {}'.format(string, lists_of_atoms))
+    logger.debug('%s:     %s', string, lists_of_atoms)
 
     # Now update the RCA4 and TORC atom indices to match the structure post
     # merging and deletion.
-    # Need this for later.
-    num_atoms = len(struct_1.atom)
-    # These are the new atom numbers for the common atoms in struct_2.
-    new_match_2 = [x + num_atoms for x in match_2]
+    if atom_map is None:
+        atom_map = get_atom_map(struct_1, match_1, struct_2, match_2)
     # Contains new RCA4 commands.
-    new_lists_of_atoms = []
-    for atoms in lists_of_atoms:
-        new_atoms = []
-        for x in atoms:
-            if x in match_2:
-                # If the RCA4/TORC atom is one of the matching/duplicate/common
-                # atoms, it's going to get deleted. This replaces the index of
-                # that atom with the matching atom in the 1st structure.
-                new_atoms.append(match_1[match_2.index(x)])
-            else:
-                # The atoms in 2nd structure will always be added after the
-                # atoms in the 1st structure. This adjusts the atom indices
-                # appropriately.
-                new_index = x + num_atoms
-                # If matching/duplicate/common atoms occur in the list before
-                # this one, those atoms are going to get deleted. We need to
-                # account for them disappearing.
-                atoms_in_str_2_before_this_one = \
-                    sum(i < new_index for i in new_match_2)
-                new_index -= atoms_in_str_2_before_this_one
-                new_atoms.append(new_index)
-        new_lists_of_atoms.append(new_atoms)
-    print('{} NEW: {}'.format(string, new_lists_of_atoms))
-
-    print(' * UPDATING {}:'.format(string))
+    new_lists_of_atoms = [[atom_map[x] for x in atoms]
+                          for atoms in lists_of_atoms]
+    logger.debug('%s NEW: %s', string, new_lists_of_atoms)
+
+    logger.debug(' * UPDATING %s:', string)
+    debug = logger.isEnabledFor(logging.DEBUG)
     # Now have to update the bonds RCA4 properties.
     for atoms in new_lists_of_atoms:
-        bond = merge.getBond(atoms[1], atoms[2])
-        print('   * BOND:     {:>4}    {:>4}/{:2} {:>4}/{:2} {:>4}'.format(
-            bond.property[str1],
-            bond.atom1.index,
-            bond.atom1.atom_type_name,
-            bond.atom2.index,
-            bond.atom2.atom_type_name,
-            bond.property[str2]))
+        bond = bonds[frozenset((atoms[1], atoms[2]))]
+        if debug:
+            logger.debug(
+                '   * BOND:     %4s    %4s/%-2s %4s/%-2s %4s',
+                bond.property[str1],
+                bond.atom1.index,
+                bond.atom1.atom_type_name,
+                bond.atom2.index,
+                bond.atom2.atom_type_name,
+                bond.property[str2])
         bond.property[str1] = atoms[0]
         bond.property[str2] = atoms[3]
-        print('     * UPDATE: '
-              '{:>4}/{:2} {:>4}/{:2} {:>4}/{:2} {:>4}/{:2}'.format(
-            merge.atom[bond.property[str1]].index,
-            merge.atom[bond.property[str1]].atom_type_name,
-            bond.atom1.index,
-            bond.atom1.atom_type_name,
-            bond.atom2.index,
-            bond.atom2.atom_type_name,
-            merge.atom[bond.property[str2]].index,
-            merge.atom[bond.property[str2]].atom_type_name))
+        if debug:
+            logger.debug(
+                '     * UPDATE: %4s/%-2s %4s/%-2s %4s/%-2s %4s/%-2s',
+                merge.atom[bond.property[str1]].index,
+                merge.atom[bond.property[str1]].atom_type_name,
+                bond.atom1.index,
+                bond.atom1.atom_type_name,
+                bond.atom2.index,
+                bond.atom2.atom_type_name,
+                merge.atom[bond.property[str2]].index,
+                merge.atom[bond.property[str2]].atom_type_name)
     return merge
 
 
@@ -939,6 +1388,9 @@ def mini(structures, frozen_atoms=None, fix_torsions=None):
     Takes many structures, minimizes them and returns the minimized structures.
     It's faster to do multiple structures at once.
 
+    Don't pass a generator whose structures are made by calling mini or mcmm.
+    They share the same temporary files.
+
     Arguments
     ---------
     structure : list of Schrödinger structure
@@ -950,40 +1402,40 @@ def mini(structures, frozen_atoms=None, fix_torsions=None):
     import schrodinger.application.macromodel.utils as mmodutils
     import schrodinger.job.jobcontrol as jobcontrol
     from setup_com_from_mae import MyComUtil
-    print(' - ATTEMPTING MINI')
-    sch_writer = sch_struct.StructureWriter('TEMP.mae')
+    logger.info(' - ATTEMPTING MINI')
+    sch_writer = sch_struct.StructureWriter(TEMP_NAME + '.mae')
     sch_writer.extend(structures)
     sch_writer.close()
     # Setup the minimization.
     com_setup = MyComUtil()
     com_setup.my_mini(
-        mae_file='TEMP.mae',
-        com_file='TEMP.com',
-        out_file='TEMP_OUT.mae',
+        mae_file=TEMP_NAME + '.mae',
+        com_file=TEMP_NAME + '.com',
+        out_file=TEMP_NAME + '_OUT.mae',
         frozen_atoms=frozen_atoms,
         fix_torsions=fix_torsions)
-    command = ['bmin', '-WAIT', 'TEMP']
+    command = ['bmin', '-WAIT', TEMP_NAME]
     # Run the minimization.
     job = jobcontrol.launch_job(command)
     job.wait()
     # Read the minimized structures.
-    sch_reader = sch_struct.StructureReader('TEMP_OUT.mae')
+    sch_reader = sch_struct.StructureReader(TEMP_NAME + '_OUT.mae')
     new_structures = []
     for structure in sch_reader:
         new_structures.append(structure)
     sch_reader.close()
     if len(new_structures) > 0:
-        print(' - MINI SUCCEEDED')
+        logger.info(' - MINI SUCCEEDED')
         structures = [new_structures[0]]
     else:
-        print(' - MINI FAILED. CONTINUING W/O MINI')
+        logger.warning(' - MINI FAILED. CONTINUING W/O MINI')
     if DEBUG:
-        raw_input('Press any button to continue.')
+        input('Press any button to continue.')
     # Remove temporary files.
-    os.remove('TEMP.mae')
-    os.remove('TEMP.com')
-    os.remove('TEMP_OUT.mae')
-    os.remove('TEMP.log')
+    os.remove(TEMP_NAME + '.mae')
+    os.remove(TEMP_NAME + '.com')
+    os.remove(TEMP_NAME + '_OUT.mae')
+    os.remove(TEMP_NAME + '.log')
     return structures
 
 def mcmm(structures, frozen_atoms=None):
@@ -1001,37 +1453,37 @@ def mcmm(structures, frozen_atoms=None):
     import schrodinger.application.macromodel.utils as mmodutils
     import schrodinger.job.jobcontrol as jobcontrol
     from setup_com_from_mae import MyComUtil
-    print(' - ATTEMPTING MCMM')
-    sch_writer = sch_struct.StructureWriter('TEMP.mae')
+    logger.info(' - ATTEMPTING MCMM')
+    sch_writer = sch_struct.StructureWriter(TEMP_NAME + '.mae')
     sch_writer.extend(structures)
     sch_writer.close()
     com_setup = MyComUtil()
     com_setup.my_mcmm(
-        mae_file='TEMP.mae',
-        com_file='TEMP.com',
-        out_file='TEMP_OUT.mae',
+        mae_file=TEMP_NAME + '.mae',
+        com_file=TEMP_NAME + '.com',
+        out_file=TEMP_NAME + '_OUT.mae',
         nsteps=50,
         frozen_atoms=frozen_atoms)
-    command = ['bmin', '-WAIT', 'TEMP']
+    command = ['bmin', '-WAIT', TEMP_NAME]
     job = jobcontrol.launch_job(command)
     job.wait()
-    sch_reader = sch_struct.StructureReader('TEMP_OUT.mae')
+    sch_reader = sch_struct.StructureReader(TEMP_NAME + '_OUT.mae')
     new_structures = []
     for structure in sch_reader:
         new_structures.append(structure)
     sch_reader.close()
     if len(new_structures) > 0:
-        print(' - MCMM SUCCEEDED')
+        logger.info(' - MCMM SUCCEEDED')
         structures = [new_structures[0]]
     else:
-        print(' - MCMM FAILED. CONTINUING W/O MCMM')
+        logger.warning(' - MCMM FAILED. CONTINUING W/O MCMM')
     if DEBUG:
-        raw_input('Press any button to continue.')
+        input('Press any button to continue.')
     # Remove temporary files.
-    os.remove('TEMP.mae')
-    os.remove('TEMP.com')
-    os.remove('TEMP_OUT.mae')
-    os.remove('TEMP.log')
+    os.remove(TEMP_NAME + '.mae')
+    os.remove(TEMP_NAME + '.com')
+    os.remove(TEMP_NAME + '_OUT.mae')
+    os.remove(TEMP_NAME + '.log')
     return structures
 
 def make_unique_filename(path):
@@ -1093,4 +1545,8 @@ def remove_uplicates(iterable):
 if __name__ == '__main__':
     parser = return_parser()
     opts = parser.parse_args(sys.argv[1:])
-    structures = main(opts)
+    logging.basicConfig(
+        format='%(message)s',
+        level=logging.DEBUG if opts.verbose else logging.INFO,
+        stream=sys.stdout)
+    main(opts)